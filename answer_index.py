@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+'''
+Memory-mapped string tables and the precomputed word answer index.
+
+Kept apart from classify.py and free of heavy imports so that lookup.py can
+answer cached words without compiling or importing the full classifier.
+'''
+import array
+import mmap
+import os
+
+
+def write_mapped_table(path, items):
+    '''
+    Writes (key, value) string pairs as a key-sorted line file plus an array
+    of line offsets, so that MappedTable can look keys up without loading
+    either file.
+    '''
+    offsets = array.array('Q')
+    with open(f'{path}.dat', 'wb') as f:
+        for (key, value) in sorted((key.encode('utf-8'), value.encode('utf-8')) for (key, value) in items):
+            offsets.append(f.tell())
+            f.write(key + b'\t' + value + b'\n')
+    with open(f'{path}.idx', 'wb') as f:
+        offsets.tofile(f)
+
+
+class MappedTable:
+    '''
+    Read-only string table written by write_mapped_table, memory-mapped
+    and binary searched in place. Only the pages a lookup touches become
+    resident, and they are shared between processes mapping the same file.
+    '''
+
+    def __init__(self, path):
+        self._data_file = open(f'{path}.dat', 'rb')
+        self._offsets_file = open(f'{path}.idx', 'rb')
+        if os.path.getsize(f'{path}.idx') == 0:
+            self._data = self._offsets_map = None
+            self._offsets = []
+            return
+        self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets_map = mmap.mmap(self._offsets_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = memoryview(self._offsets_map).cast('Q')
+
+    def _key_at(self, index):
+        start = self._offsets[index]
+        return self._data[start:self._data.find(b'\t', start)]
+
+    def get(self, key):
+        key = key.encode('utf-8')
+        lo, hi = 0, len(self._offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(self._offsets) or self._key_at(lo) != key:
+            return None
+        start = self._offsets[lo] + len(key) + 1
+        return self._data[start:self._data.find(b'\n', start)].decode('utf-8')
+
+    def close(self):
+        if self._data is not None:
+            self._offsets.release()
+            self._offsets_map.close()
+            self._data.close()
+        self._offsets_file.close()
+        self._data_file.close()
+
+
+def _input_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return f'-1\t-1\t{path}'
+    return f'{stat.st_size}\t{stat.st_mtime_ns}\t{path}'
+
+
+def write_stamp(path, input_paths):
+    '''
+    Records the size and modification time of each input path, so that
+    stamp_is_current can later tell whether any of them changed.
+    '''
+    with open(path, 'w', encoding="utf-8") as f:
+        for input_path in input_paths:
+            f.write(_input_stamp(input_path) + '\n')
+
+
+def stamp_is_current(path):
+    '''
+    Whether the stamp file exists and none of its inputs changed since
+    write_stamp wrote it.
+    '''
+    if not os.path.exists(path):
+        return False
+    with open(path, 'r', encoding="utf-8") as f:
+        for line in f:
+            if _input_stamp(line.rstrip('\n').split('\t', 2)[2]) != line.rstrip('\n'):
+                return False
+    return True
+
+
+def write_answer_index(answers, input_paths, path='build/answers'):
+    '''
+    Writes (word, ID, level or None, gloss) answers as a mapped table, with
+    a stamp of the input paths alongside so that lookup_answer can tell
+    when the answers have gone stale.
+    '''
+    write_mapped_table(path, (
+        (word, f"{entry_id}\t{level or ''}\t{gloss.replace(chr(10), ' ')}")
+        for (word, entry_id, level, gloss) in answers
+    ))
+    write_stamp(f'{path}.stamp', input_paths)
+
+
+def lookup_answer(word, path='build/answers'):
+    '''
+    The (ID, level or None, gloss) precomputed for a word, or None if the
+    answer index does not cover it or any of its inputs changed since it
+    was written.
+    '''
+    if not stamp_is_current(f'{path}.stamp'):
+        return None
+    table = MappedTable(path)
+    try:
+        value = table.get(word)
+    finally:
+        table.close()
+    if value is None:
+        return None
+    entry_id, level, gloss = value.split('\t', 2)
+    return int(entry_id), int(level) if level else None, gloss
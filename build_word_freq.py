@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Builds a ranked word frequency list from pre-tokenized corpora.
+
+Input files hold tokens separated by whitespace or newlines. They are split
+into byte-range chunks which are counted across a process pool; each chunk's
+counts are spilled to a sorted file on disk and the spills are merged as a
+stream. The merged counts are spilled again in rank-sorted runs and merged
+for the output, so memory stays bounded by the chunk and run sizes rather
+than the corpus or vocabulary size. The output uses the
+japanese_wikipedia_word_freq.csv format read by
+classify._get_wikipedia_word_frequencies.
+
+Usage: build_word_freq.py [--workers N] [--min-count N] [--limit N] CORPUS... OUTPUT
+'''
+import argparse
+from collections import Counter
+import heapq
+import itertools
+import multiprocessing
+import os
+import sys
+import tempfile
+
+CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+RUN_SIZE = 1000000
+WHITESPACE = b' \t\r\n\f\v'
+
+
+def _chunk_offsets(path, chunk_size=CHUNK_SIZE):
+    '''
+    Splits a file into (start, end) byte ranges that end on whitespace.
+
+    Multi-byte UTF-8 sequences never contain ASCII whitespace bytes, so a
+    token never straddles two chunks.
+    '''
+    size = os.path.getsize(path)
+    offsets = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            end = min(start + chunk_size, size)
+            f.seek(end)
+            while end < size:
+                block = f.read(READ_SIZE)
+                if not block:
+                    end = size
+                    break
+                boundary = next((i for (i, b) in enumerate(block) if b in WHITESPACE), None)
+                if boundary is not None:
+                    end += boundary
+                    break
+                end += len(block)
+            offsets.append((start, end))
+            start = end
+    return offsets
+
+
+def _count_chunk(job):
+    '''
+    Counts the tokens in one byte range and spills them, sorted, to disk.
+    '''
+    path, start, end, spill_path = job
+    counts = Counter()
+    carry = b''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(READ_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            block = carry + block
+            # Hold back a trailing partial token until the next block arrives.
+            cut = max(block.rfind(bytes([b])) for b in WHITESPACE) + 1
+            carry = block[cut:]
+            counts.update(block[:cut].decode('utf-8', errors='replace').split())
+    counts.update(carry.decode('utf-8', errors='replace').split())
+
+    with open(spill_path, 'w', encoding="utf-8") as f:
+        for word in sorted(counts):
+            f.write(f'{word}\t{counts[word]}\n')
+    return spill_path
+
+
+def _read_spill(path):
+    with open(path, 'r', encoding="utf-8") as f:
+        for line in f:
+            word, count = line.rstrip('\n').rsplit('\t', 1)
+            yield word, int(count)
+
+
+def _merge_spills(spill_paths):
+    '''
+    Yields (word, total count) in word order from sorted spill files.
+    '''
+    merged = heapq.merge(*[_read_spill(path) for path in spill_paths], key=lambda x: x[0])
+    for (word, group) in itertools.groupby(merged, key=lambda x: x[0]):
+        yield word, sum(count for (_, count) in group)
+
+
+def _write_rank_run(pairs, path):
+    '''
+    Spills (count, word) pairs to disk sorted by rank order.
+    '''
+    pairs.sort(key=lambda x: (-x[0], x[1]))
+    with open(path, 'w', encoding="utf-8") as f:
+        for (count, word) in pairs:
+            f.write(f'{word}\t{count}\n')
+    return path
+
+
+def _read_rank_run(path):
+    for (word, count) in _read_spill(path):
+        yield count, word
+
+
+def build_word_frequencies(corpus_paths, output_path, workers=None, min_count=1, limit=None,
+                           chunk_size=CHUNK_SIZE, run_size=RUN_SIZE):
+    '''
+    Counts tokens in the corpora and writes them ranked by frequency.
+
+    Words seen fewer than min_count times are dropped from the list (but
+    still count towards the percentages); limit keeps only the N most
+    frequent words. Merged counts are spilled in rank-sorted runs of at
+    most run_size words and merged again for the output, so the ranking
+    never holds more than run_size words in memory either.
+    '''
+    with tempfile.TemporaryDirectory(prefix='word-freq-') as spill_dir:
+        jobs = []
+        for path in corpus_paths:
+            for (start, end) in _chunk_offsets(path, chunk_size=chunk_size):
+                jobs.append((path, start, end, os.path.join(spill_dir, f'{len(jobs)}.tsv')))
+
+        with multiprocessing.Pool(workers) as pool:
+            spill_paths = list(pool.imap_unordered(_count_chunk, jobs))
+
+        total = 0
+        run = []
+        run_paths = []
+        for (word, count) in _merge_spills(spill_paths):
+            total += count
+            # The wikipedia list loader splits rows on commas.
+            if count < min_count or ',' in word:
+                continue
+            run.append((count, word))
+            if len(run) >= run_size:
+                run_paths.append(_write_rank_run(run, os.path.join(spill_dir, f'run-{len(run_paths)}.tsv')))
+                run = []
+        if run:
+            run_paths.append(_write_rank_run(run, os.path.join(spill_dir, f'run-{len(run_paths)}.tsv')))
+            run = []
+
+        ranked = heapq.merge(*[_read_rank_run(path) for path in run_paths], key=lambda x: (-x[0], x[1]))
+        word_count = 0
+        cumulative = 0
+        with open(output_path, 'w', encoding="utf-8") as f:
+            f.write('Rank,Word,Occurences,Percentage,Cumulative%\n')
+            for (rank, (count, word)) in enumerate(itertools.islice(ranked, limit), start=1):
+                cumulative += count
+                word_count = rank
+                f.write(f'{rank},{word},{count},{100 * count / total:.5f}%,{100 * cumulative / total:.3f}%\n')
+    return word_count, total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a ranked word frequency list from pre-tokenized corpora.')
+    parser.add_argument('corpus', nargs='+', help='pre-tokenized text files')
+    parser.add_argument('output', help='CSV file to write')
+    parser.add_argument('--workers', type=int, default=None, help='counting processes (default: CPU count)')
+    parser.add_argument('--min-count', type=int, default=1, help='drop words seen fewer times than this')
+    parser.add_argument('--limit', type=int, default=None, help='keep only the N most frequent words')
+    args = parser.parse_args()
+    for path in args.corpus:
+        if not os.path.exists(path):
+            sys.exit(f'{path} does not exist')
+    word_count, token_count = build_word_frequencies(
+        args.corpus, args.output, workers=args.workers, min_count=args.min_count, limit=args.limit)
+    print(f'Wrote {word_count} words from {token_count} tokens to {args.output}')
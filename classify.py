@@ -1,16 +1,46 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+'''
+Generates JLPT vocabulary levels from JMDict, the JLPT lists and word
+frequencies, and looks words up in them.
+
+Usage: classify.py [WORD]
+       classify.py --quotas N5,N4,N3,N2,N1
+       classify.py --coverage [N5,N4,N3,N2,N1 ...]
+       classify.py --compare OLD_JMDICT NEW_JMDICT [OUTPUT]
+       classify.py --export {tsv,jsonl,parquet,anki} PATH
+       classify.py --build-low-memory
+       classify.py --low-memory WORD... | -
+'''
 import json
 from functools import reduce
+import heapq
+import html
+import itertools
 import os
-import zipfile
 import sys
 
-import requests
+import answer_index
 
 JMDICT_VERSION = '3.3.1'
 JMDICT_JSON_URL = 'https://github.com/scriptin/jmdict-simplified/releases/download/3.3.1%2B20230206121907/jmdict-eng-3.3.1+20230206121907.json.zip'
 JMDICT_COMMON_JSON_URL = 'https://github.com/scriptin/jmdict-simplified/releases/download/3.3.1%2B20230206121907/jmdict-eng-common-3.3.1+20230206121907.json.zip'
+VOCAB_COUNTS = {
+    5: 800,
+    4: 1500,
+    3: 3750,
+    2: 6000,
+    1: 10000,
+}
+# Bump whenever the candidate stream's schema changes. Matching logic edits
+# need no bump: _input_fingerprint hashes this file's source as well.
+CANDIDATE_STREAM_FORMAT = 2
+KANJI_EXAMPLE_COUNT = 5
+EXPORT_GLOSS_COUNT = 3
+EXPORT_FORMATS = ('tsv', 'jsonl', 'parquet', 'anki')
+# Private (anonymous) memory budget for LowMemoryDictionary lookups, enforced by
+# test_low_memory.py; see LowMemoryDictionary.
+LOW_MEMORY_CEILING_MB = 32
 JLPT_COLORS = {
     1: '#d84c43',
     2: '#f6934b',
@@ -534,6 +564,13 @@ def _is_kana(s: str) -> bool:
     return all(_char_is_kana(c) for c in s)
 
 
+def _char_is_kanji(c) -> bool:
+    return any([start <= ord(c) <= end for start, end in
+                [(0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF),
+                 (0x20000, 0x2FFFF)]
+                ])
+
+
 def _make_build_dir():
     if not os.path.exists('build'):
         os.makedirs('build')
@@ -551,12 +588,14 @@ def _get_cb4960_word_frequencies():
     return frequencies
 
 
-def _get_wikipedia_word_frequencies():
+def _get_wikipedia_word_frequencies(path='japanese_wikipedia_word_freq.csv'):
     '''
     Maps word to frequency rank in corpus.
+
+    Also reads lists generated by build_word_freq.py, which share this format.
     '''
     frequencies = {}
-    with open('japanese_wikipedia_word_freq.csv', 'r', encoding="utf-8") as f:
+    with open(path, 'r', encoding="utf-8") as f:
         next(f) # Skip header row.
         for line in f:
             rank, word, *rest = line.split(',')
@@ -564,6 +603,30 @@ def _get_wikipedia_word_frequencies():
     return frequencies
 
 
+def _get_wikipedia_word_occurrences(path='japanese_wikipedia_word_freq.csv'):
+    '''
+    Maps word to its token count in corpus, and returns the corpus's total
+    token count alongside.
+
+    The list may be truncated (the published one keeps the top 20k words),
+    so the total is worked out from the most frequent word's count and
+    Percentage column rather than by summing the listed counts.
+    '''
+    occurrences = {}
+    total = 0
+    top_count = 0
+    with open(path, 'r', encoding="utf-8") as f:
+        next(f) # Skip header row.
+        for line in f:
+            rank, word, count, percentage, *rest = line.split(',')
+            count, percentage = int(count), float(percentage.rstrip('%'))
+            occurrences[word] = count
+            if count > top_count and percentage > 0:
+                top_count = count
+                total = round(100 * count / percentage)
+    return occurrences, max(total, sum(occurrences.values()))
+
+
 def _get_vn_word_frequencies():
     '''
     Maps word to frequency rank in visual novel corpus.
@@ -590,18 +653,26 @@ def _get_narou_word_frequencies():
     return frequencies
 
 
+def _download_jmdict(url, zip_path):
+    # Imported here so that commands which never download stay fast to start.
+    import requests
+    import zipfile
+
+    r = requests.get(url, stream=True)
+    r.raise_for_status()
+    with open(zip_path, 'wb') as f:
+        f.write(r.content)
+    zip_ref = zipfile.ZipFile(zip_path, 'r')
+    zip_ref.extractall('build/')
+    zip_ref.close()
+
+
 def _load_jmdict():
     '''
     Maps JMDict ID to JMDict entry.
     '''
     if not os.path.exists(f'build/jmdict-eng-{JMDICT_VERSION}.json'):
-        r = requests.get(JMDICT_JSON_URL, stream=True)
-        r.raise_for_status()
-        with open('build/jmdict_eng.json.zip', 'wb') as f:
-            f.write(r.content)
-        zip_ref = zipfile.ZipFile('build/jmdict_eng.json.zip', 'r')
-        zip_ref.extractall('build/')
-        zip_ref.close()
+        _download_jmdict(JMDICT_JSON_URL, 'build/jmdict_eng.json.zip')
     with open(f'build/jmdict-eng-{JMDICT_VERSION}.json', 'r', encoding="utf-8") as f:
         jmdict = json.load(f)
     return {int(entry['id']): entry for entry in jmdict['words']}
@@ -612,18 +683,21 @@ def _load_jmdict_common():
     Maps JMDict ID to JMDict entry.
     '''
     if not os.path.exists(f'build/jmdict-eng-common-{JMDICT_VERSION}.json'):
-        r = requests.get(JMDICT_COMMON_JSON_URL, stream=True)
-        r.raise_for_status()
-        with open('build/jmdict_eng_common.json.zip', 'wb') as f:
-            f.write(r.content)
-        zip_ref = zipfile.ZipFile('build/jmdict_eng_common.json.zip', 'r')
-        zip_ref.extractall('build/')
-        zip_ref.close()
+        _download_jmdict(JMDICT_COMMON_JSON_URL, 'build/jmdict_eng_common.json.zip')
     with open(f'build/jmdict-eng-common-{JMDICT_VERSION}.json', 'r', encoding="utf-8") as f:
         jmdict = json.load(f)
     return {int(entry['id']): entry for entry in jmdict['words']}
 
 
+def _load_jmdict_file(path):
+    '''
+    Maps JMDict ID to JMDict entry for a local jmdict-simplified JSON file.
+    '''
+    with open(path, 'r', encoding="utf-8") as f:
+        jmdict = json.load(f)
+    return {int(entry['id']): entry for entry in jmdict['words']}
+
+
 def _get_jlpt_lists(jmdict):
     '''
     Maps JLPT level integer to a list of JMDict entries.
@@ -644,7 +718,74 @@ def _get_jlpt_lists(jmdict):
     return jlpts
 
 
-def match_word(word, all_jmes, used_ids=set()):
+def _read_jlpt_levels(jmdict):
+    '''
+    Maps JLPT level integer to the list of JMDict entries generated for it.
+    '''
+    levels = {}
+    for level in range(1, 6):
+        with open(f'build/jlpt-n{level}.txt', 'r', encoding="utf-8") as f:
+            levels[level] = [jmdict[int(line)] for line in f if int(line) in jmdict]
+    return levels
+
+
+def _sense_mask(jme):
+    '''
+    Bitmask of the entry's senses that individually pass the POS, gloss,
+    field and misc checks; bit i is set when sense i qualifies.
+    '''
+    mask = 0
+    pos = []
+    for (i, sense) in enumerate(jme['sense']):
+        # JMDict senses without their own POS inherit it from the previous sense.
+        pos = sense['partOfSpeech'] or pos
+        if all(single_pos in SKIP_TYPES for single_pos in pos):
+            continue
+        if not any(all(t not in g['text'] for t in SKIP_GLOSS_SUBSTRINGS) for g in sense['gloss']):
+            continue
+        if any(t in sense['field'] for t in SKIP_TYPES):
+            continue
+        if any(t in sense['misc'] for t in SKIP_TYPES):
+            continue
+        mask |= 1 << i
+    return mask
+
+
+def _build_sense_masks(all_jmes):
+    '''
+    Maps JMDict ID to its sense eligibility bitmask (see _sense_mask).
+    '''
+    sense_masks = {}
+    for jme in all_jmes:
+        if int(jme['id']) not in sense_masks:
+            sense_masks[int(jme['id'])] = _sense_mask(jme)
+    return sense_masks
+
+
+def _qualified_sense(jme, sense_masks=None):
+    '''
+    The first sense that passed every check, falling back to the first sense.
+    '''
+    mask = sense_masks[int(jme['id'])] if sense_masks is not None else _sense_mask(jme)
+    if not mask:
+        return jme['sense'][0]
+    return jme['sense'][(mask & -mask).bit_length() - 1]
+
+
+def _qualified_gloss(jme, sense_masks=None):
+    return _qualified_sense(jme, sense_masks)['gloss'][0]['text']
+
+
+def _qualified_glosses(jme, sense_masks=None):
+    '''
+    First gloss of each qualifying sense, up to EXPORT_GLOSS_COUNT.
+    '''
+    mask = sense_masks[int(jme['id'])] if sense_masks is not None else _sense_mask(jme)
+    glosses = [sense['gloss'][0]['text'] for (i, sense) in enumerate(jme['sense']) if mask & (1 << i)]
+    return glosses[:EXPORT_GLOSS_COUNT] or [jme['sense'][0]['gloss'][0]['text']]
+
+
+def match_word(word, all_jmes, used_ids=set(), sense_masks=None):
     found_data = None
     for kana_only in [True, False]:
         if found_data is not None:
@@ -653,42 +794,12 @@ def match_word(word, all_jmes, used_ids=set()):
             continue
 
         for jme in all_jmes:
-            # TODO: It should iterate over candidate senses and reject in turn if any fail,
-            # instead of approving each qualification independently.
             if int(jme['id']) in SKIP_ENTRIES.get(word, []) or int(jme['id']) in SKIP_ENTRY_IDS or int(jme['id']) in used_ids:
                 continue
 
-            ok_pos = False
-            for pos in [e['partOfSpeech'] for e in jme['sense']]:
-                if ok_pos:
-                    break
-                for single_pos in pos:
-                    if single_pos not in SKIP_TYPES:
-                        ok_pos = True
-                        break
-            if not ok_pos:
-                continue
-
-            ok_gloss = False
-            for gloss in [e['gloss'] for e in jme['sense']]:
-                for gloss_text in [g['text'] for g in gloss]:
-                    if all(t not in gloss_text for t in SKIP_GLOSS_SUBSTRINGS):
-                        ok_gloss = True
-            if not ok_gloss:
-                continue
-
-            ok_field = False
-            for field in [e['field'] for e in jme['sense']]:
-                if all(t not in field for t in SKIP_TYPES):
-                    ok_field = True
-            if not ok_field:
-                continue
-
-            ok_misc = False
-            for misc in [e['misc'] for e in jme['sense']]:
-                if all(t not in misc for t in SKIP_TYPES):
-                    ok_misc = True
-            if not ok_misc:
+            # An entry qualifies only if a single sense passes every check.
+            mask = sense_masks[int(jme['id'])] if sense_masks is not None else _sense_mask(jme)
+            if not mask:
                 continue
 
             if word in [e['text'] for e in jme['kanji'] if not {t for t in e['tags']}.intersection(SKIP_TYPES)] or word in [e['text'] for e in jme['kana'] if not {t for t in e['tags']}.intersection(SKIP_TYPES)]:
@@ -701,68 +812,715 @@ def match_word(word, all_jmes, used_ids=set()):
     return found_data
 
 
-def write_jlpt_levels(all_jmes, jlpt_levels, word_frequencies):
-    vocab_counts = {
-        5: 800,
-        4: 1500,
-        3: 3750,
-        2: 6000,
-        1: 10000,
+def _build_candidate_index(all_jmes, sense_masks):
+    '''
+    Maps surface word to the IDs match_word would consider for it, in the
+    order it would consider them, before any IDs are used up.
+
+    match_word(word, used_ids=used_ids) is then the first ID in this list
+    that is not in used_ids.
+    '''
+    kana_only_ids = {}
+    all_ids = {}
+    for jme in all_jmes:
+        jme_id = int(jme['id'])
+        if jme_id in SKIP_ENTRY_IDS or not sense_masks[jme_id]:
+            continue
+        if len(jme['kanji']) > 0 and not _is_cjk(jme['kanji'][0]['text']):
+            continue
+        surface_words = {e['text'] for e in jme['kanji'] + jme['kana'] if not {t for t in e['tags']}.intersection(SKIP_TYPES)}
+        for word in surface_words:
+            if word in SKIP_ENTRIES and jme_id in SKIP_ENTRIES[word]:
+                continue
+            all_ids.setdefault(word, []).append(jme_id)
+            if not jme['kanji']:
+                kana_only_ids.setdefault(word, []).append(jme_id)
+
+    candidate_index = {}
+    for (word, ids) in all_ids.items():
+        if _is_kana(word):
+            ids = kana_only_ids.get(word, []) + ids
+        candidate_index[word] = list(dict.fromkeys(ids))
+    return candidate_index
+
+
+def _entry_used_words(jme):
+    '''
+    Words that an entry's assignment to a level takes out of later matching.
+    '''
+    used_words = set()
+    # TODO: this kana dedupe could be improved
+    if any('uk' in s['misc'] for s in jme['sense']) or any(kana['common'] for kana in jme['kana']) or not jme['kanji']:
+        for kana in jme['kana']:
+            used_words.add(kana['text'])
+    for kanji in jme['kanji']:
+        used_words.add(kanji['text'])
+    for sense in jme['sense']:
+        for related in sense['related']:
+            used_words.add(related[0])
+    return used_words
+
+
+def _stream_entry(jme, sense_masks):
+    return {
+        'id': jme['id'],
+        'kanji': [{'text': kanji['text']} for kanji in jme['kanji']],
+        'kana': [{'text': kana['text']} for kana in jme['kana']],
+        'used': sorted(_entry_used_words(jme)),
+        'glosses': _qualified_glosses(jme, sense_masks),
+    }
+
+
+def _input_fingerprint(frequency_path='cb4960_novel_word_freq.txt'):
+    '''
+    Hash of every input that affects which words are accepted and in what
+    order: the seeded JLPT lists, the frequency list, the skip lists, the
+    JMDict version, the candidate stream format and this file's source,
+    which holds the matching logic.
+    '''
+    import hashlib
+
+    digest = hashlib.sha256()
+    for path in [os.path.abspath(__file__)] + [f'jlpt-n{level}.csv' for level in range(1, 6)] + [frequency_path]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for skip_list in [SKIP_TYPES, SKIP_ENTRY_IDS, SKIP_GLOSS_SUBSTRINGS, SKIP_WORDS]:
+        digest.update(repr(sorted(skip_list)).encode('utf-8'))
+    digest.update(repr(sorted(SKIP_ENTRIES.items())).encode('utf-8'))
+    digest.update(JMDICT_VERSION.encode('utf-8'))
+    digest.update(str(CANDIDATE_STREAM_FORMAT).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def record_candidate_stream(all_jmes, jlpt_levels, word_frequencies, sense_masks=None):
+    '''
+    Records everything level slicing needs, independent of the quotas.
+
+    This is each frequency-ordered word with its candidate IDs, the seeded
+    JLPT list IDs, and the used words and display data of every entry that
+    can be assigned. slice_jlpt_levels turns this into level files for any
+    quotas without JMDict.
+    '''
+    if sense_masks is None:
+        sense_masks = _build_sense_masks(all_jmes)
+    candidate_index = _build_candidate_index(all_jmes, sense_masks)
+    jmes = {int(jme['id']): jme for jme in all_jmes}
+
+    words = []
+    for word in [e[0] for e in sorted(word_frequencies.items(), key=lambda x: x[1])]:
+        if word in SKIP_WORDS or word not in candidate_index:
+            continue
+        words.append([word, candidate_index[word]])
+
+    seeds = {level_number: [int(entry['id']) for entry in level_entries]
+             for (level_number, level_entries) in jlpt_levels.items()}
+    entry_ids = {entry_id for (_, ids) in words for entry_id in ids}
+    entry_ids.update(entry_id for ids in seeds.values() for entry_id in ids)
+    entries = {entry_id: _stream_entry(jmes[entry_id], sense_masks) for entry_id in entry_ids}
+    frequencies = {item['text']: word_frequencies[item['text']]
+                   for entry in entries.values() for item in entry['kanji'] + entry['kana']
+                   if item['text'] in word_frequencies}
+    return {
+        'words': words,
+        'seeds': seeds,
+        'entries': entries,
+        'frequencies': frequencies,
     }
-    words = [e[0] for e in sorted(word_frequencies.items(), key=lambda x: x[1])]
+
+
+def save_candidate_stream(stream, path='build/candidate-stream.json'):
+    with open(path, 'w', encoding="utf-8") as f:
+        json.dump(stream, f, ensure_ascii=False)
+
+
+def load_candidate_stream(path='build/candidate-stream.json'):
+    with open(path, 'r', encoding="utf-8") as f:
+        stream = json.load(f)
+    stream['seeds'] = {int(level): ids for (level, ids) in stream['seeds'].items()}
+    stream['entries'] = {int(entry_id): entry for (entry_id, entry) in stream['entries'].items()}
+    return stream
+
+
+def _load_current_candidate_stream():
+    '''
+    The recorded candidate stream, or None if it is missing or was recorded
+    from different inputs.
+    '''
+    if not os.path.exists('build/candidate-stream.json'):
+        return None
+    stream = load_candidate_stream()
+    if stream.get('fingerprint') != _input_fingerprint():
+        return None
+    return stream
+
+
+def slice_jlpt_levels(stream, vocab_counts=VOCAB_COUNTS, verbose=True, write_files=True, matches=None):
+    '''
+    Assigns words to levels from a recorded candidate stream.
+
+    Used words and IDs only ever grow, so a word that was passed over at one
+    level stays passed over at the next; each level resumes the scan where
+    the previous one stopped instead of restarting at the top.
+
+    If matches is given, it is filled with each accepted word's entry ID.
+    '''
+    words = stream['words']
+    entries = stream['entries']
     used_words = set()
     used_ids = set()
+    assigned_levels = {}
+    position = 0
 
-    for (level_number, level_entries) in sorted(jlpt_levels.items(), key=lambda x: -x[0]):
-        offset = 0
-        with open(f'build/jlpt-n{level_number}.txt', 'w', encoding="utf-8") as f:
-            for entry in level_entries:
-                print(f"N{level_number} {entry['id']} {entry['kanji'][0] if entry['kanji'] else entry['kana'][0]} {entry['sense'][0]['gloss'][0]['text']}")
-                f.write(f"{entry['id']}\n")
-                used_ids.add(int(entry['id']))
-                # TODO: this kana dedupe could be improved
-                if any('uk' in s['misc'] for s in entry['sense']) or any(kana['common'] for kana in entry['kana']) or not entry['kanji']:
-                    for kana in entry['kana']:
-                        used_words.add(kana['text'])
-                for kanji in entry['kanji']:
-                    used_words.add(kanji['text'])
-                for sense in entry['sense']:
-                    for related in sense['related']:
-                        used_words.add(related[0])
-            offset += len(level_entries)
-            remaining = vocab_counts[level_number] - offset
-
-            for word in words:
-                if word in SKIP_WORDS:
-                    continue
-                if word in used_words:
-                    continue
+    for (level_number, seed_ids) in sorted(stream['seeds'].items(), key=lambda x: -x[0]):
+        level_ids = []
+        for entry_id in seed_ids:
+            entry = entries[entry_id]
+            if verbose:
+                print(f"N{level_number} {entry_id} {(entry['kanji'] or entry['kana'])[0]['text']} {entry['glosses'][0]}")
+            level_ids.append(entry_id)
+            used_ids.add(entry_id)
+            used_words.update(entry['used'])
+        remaining = vocab_counts[level_number] - len(seed_ids)
 
-                found_data = match_word(word, all_jmes, used_ids=used_ids)
+        while remaining > 0 and position < len(words):
+            word, candidate_ids = words[position]
+            position += 1
+            if word in used_words:
+                continue
+            entry_id = next((i for i in candidate_ids if i not in used_ids), None)
+            if entry_id is None:
+                continue
 
-                if found_data is not None:
-                    print(f"N{level_number} {found_data['id']} {word} {found_data['sense'][0]['gloss'][0]['text']}")
-                    #f.write(f"{found_data['id']} # {word} {found_data['sense'][0]['gloss'][0]['text']}")
-                    f.write(f"{found_data['id']}\n")
-                    offset += 1
-                    remaining -= 1
-                    
-                    used_ids.add(int(found_data['id']))
-                    for kanji in found_data['kanji']:
-                        used_words.add(kanji['text'])
-                    used_words.add(word)
-                    if any('uk' in s['misc'] for s in found_data['sense']) or any(kana['common'] for kana in found_data['kana']) or not found_data['kanji']:
-                        for kana in found_data['kana']:
-                            used_words.add(kana['text'])
-                    for sense in found_data['sense']:
-                        for related in sense['related']:
-                            used_words.add(related[0])
+            if verbose:
+                print(f"N{level_number} {entry_id} {word} {entries[entry_id]['glosses'][0]}")
+            level_ids.append(entry_id)
+            remaining -= 1
+            used_ids.add(entry_id)
+            used_words.add(word)
+            used_words.update(entries[entry_id]['used'])
+            if matches is not None:
+                matches[word] = entry_id
+        if verbose:
+            print()
+
+        if write_files:
+            with open(f'build/jlpt-n{level_number}.txt', 'w', encoding="utf-8") as f:
+                for entry_id in level_ids:
+                    f.write(f"{entry_id}\n")
+        assigned_levels[level_number] = [entries[entry_id] for entry_id in level_ids]
+    return assigned_levels
+
+
+def write_jlpt_levels(all_jmes, jlpt_levels, word_frequencies, sense_masks=None, vocab_counts=VOCAB_COUNTS):
+    stream = record_candidate_stream(all_jmes, jlpt_levels, word_frequencies, sense_masks=sense_masks)
+    return slice_jlpt_levels(stream, vocab_counts)
+
+
+def _parse_vocab_counts(arg):
+    '''
+    Parses N5 through N1 quotas written as e.g. 800,1500,3750,6000,10000.
+
+    Returns None unless arg holds exactly five positive integers.
+    '''
+    try:
+        counts = [int(count) for count in arg.split(',')]
+    except ValueError:
+        return None
+    if len(counts) != len(VOCAB_COUNTS) or min(counts) <= 0:
+        return None
+    return dict(zip(range(5, 0, -1), counts))
+
+
+def reslice_jlpt_levels(vocab_counts=VOCAB_COUNTS):
+    '''
+    Rewrites the level files for new quotas from the recorded candidate
+    stream, without loading JMDict or re-matching.
+
+    Returns None when there is no stream or its inputs have changed since
+    it was recorded; a full classify() run is needed then.
+    '''
+    stream = _load_current_candidate_stream()
+    if stream is None:
+        return None
+    assigned_levels = slice_jlpt_levels(stream, vocab_counts)
+    write_kanji_levels(assigned_levels, stream['frequencies'])
+    write_answer_index(stream, assigned_levels)
+    return assigned_levels
+
+
+def _generation_input_paths():
+    '''
+    The files whose changes make generated outputs stale: the matching
+    code, the frequency list, the dictionaries and the seeded lists.
+    '''
+    return ([os.path.abspath(__file__), 'cb4960_novel_word_freq.txt',
+             f'build/jmdict-eng-{JMDICT_VERSION}.json', f'build/jmdict-eng-common-{JMDICT_VERSION}.json']
+            + [f'jlpt-n{level}.csv' for level in range(1, 6)])
+
+
+def write_answer_index(stream, assigned_levels, path='build/answers'):
+    '''
+    Writes word -> (ID, level, gloss) for every word in the candidate
+    stream, where ID is what match_word returns for the word, so that
+    command-line lookups can answer without loading JMDict.
+    '''
+    levels = {}
+    for (level_number, level_entries) in sorted(assigned_levels.items(), key=lambda x: -x[0]):
+        for entry in level_entries:
+            levels.setdefault(int(entry['id']), level_number)
+    answers = []
+    for (word, candidate_ids) in stream['words']:
+        entry_id = candidate_ids[0]
+        answers.append((word, entry_id, levels.get(entry_id), stream['entries'][entry_id]['glosses'][0]))
+    answer_index.write_answer_index(answers, _generation_input_paths(), path=path)
+
+
+def lookup_word(search):
+    '''
+    match_word's (ID, gloss) for a word, or None, from the cheapest source
+    available: the answer index written by generation if it is current,
+    then the low-memory tables if current, and only then the full
+    dictionaries.
+    '''
+    answer = answer_index.lookup_answer(search)
+    if answer is not None:
+        return answer[0], answer[2]
+    if low_memory_index_is_current():
+        with LowMemoryDictionary() as dictionary:
+            match, level = dictionary.match_word(search)
+    else:
+        match = classify(search=search)
+    if match is None:
+        return None
+    return int(match['id']), _qualified_gloss(match)
+
+
+def _entry_frequency_rank(entry, word_frequencies):
+    '''
+    Best (lowest) frequency rank among an entry's surface forms, or None.
+    '''
+    ranks = [word_frequencies[item['text']] for item in entry['kanji'] + entry['kana']
+             if item['text'] in word_frequencies]
+    return min(ranks) if ranks else None
+
+
+def write_kanji_levels(assigned_levels, word_frequencies):
+    '''
+    Derives a JLPT level per kanji from the generated vocabulary levels.
+
+    A kanji's level is the easiest level (highest N number) of any assigned
+    word written with it. Also counts words per level and keeps the most
+    frequent example words, all in a single pass over the assigned entries.
+    '''
+    kanji_levels = {}
+    seen_ids = set()
+    for (level_number, level_entries) in sorted(assigned_levels.items(), key=lambda x: -x[0]):
+        for entry in level_entries:
+            # An entry can be both matched and seeded; it counts at its easiest level only.
+            if int(entry['id']) in seen_ids:
+                continue
+            seen_ids.add(int(entry['id']))
+            rank = _entry_frequency_rank(entry, word_frequencies)
+            sort_rank = rank if rank is not None else sys.maxsize
+            characters = {c for kanji in entry['kanji'] for c in kanji['text'] if _char_is_kanji(c)}
+            for character in characters:
+                stats = kanji_levels.get(character)
+                if stats is None:
+                    stats = kanji_levels[character] = {
+                        'level': level_number,
+                        'counts': {level: 0 for level in range(1, 6)},
+                        'examples': [],
+                    }
+                stats['counts'][level_number] += 1
+                # Bounded max-heap on rank keeps only the most frequent examples.
+                word = next(kanji['text'] for kanji in entry['kanji'] if character in kanji['text'])
+                example = (-sort_rank, int(entry['id']), word, rank, level_number)
+                if len(stats['examples']) < KANJI_EXAMPLE_COUNT:
+                    heapq.heappush(stats['examples'], example)
                 else:
-                    print(f"Skipping {word}")
+                    heapq.heappushpop(stats['examples'], example)
 
-                if remaining == 0:
-                    print()
-                    break
+    for stats in kanji_levels.values():
+        stats['examples'] = [
+            {'id': entry_id, 'word': word, 'rank': rank, 'level': level}
+            for (_, entry_id, word, rank, level) in sorted(stats['examples'], reverse=True)
+        ]
+    with open('build/kanji-levels.json', 'w', encoding="utf-8") as f:
+        json.dump(kanji_levels, f, ensure_ascii=False)
+    return kanji_levels
+
+
+def load_kanji_levels():
+    '''
+    Maps kanji to its JLPT level, per-level word counts and example words.
+    '''
+    with open('build/kanji-levels.json', 'r', encoding="utf-8") as f:
+        kanji_levels = json.load(f)
+    for stats in kanji_levels.values():
+        stats['counts'] = {int(level): count for (level, count) in stats['counts'].items()}
+    return kanji_levels
+
+
+def _version_levels(jmdict_path):
+    '''
+    Generates levels for one local JMDict file, reusing its cached candidate
+    stream when the file and the other inputs are unchanged.
+
+    Returns the level of each assigned ID and the ID each word matched.
+    '''
+    import hashlib
+
+    digest = hashlib.sha256(_input_fingerprint().encode('utf-8'))
+    with open(jmdict_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    stream_path = f'build/candidate-stream-v{CANDIDATE_STREAM_FORMAT}-{digest.hexdigest()[:16]}.json'
+
+    if os.path.exists(stream_path):
+        stream = load_candidate_stream(stream_path)
+    else:
+        jmdict = _load_jmdict_file(jmdict_path)
+        # Same ordering as classify(): common entries, as in the jmdict-eng-common file, come first.
+        jmdict_common = [entry for entry in jmdict.values() if any(item['common'] for item in entry['kanji'] + entry['kana'])]
+        all_jmes = jmdict_common + list(jmdict.values())
+        stream = record_candidate_stream(all_jmes, _get_jlpt_lists(jmdict), _get_cb4960_word_frequencies())
+        save_candidate_stream(stream, stream_path)
+
+    matches = {}
+    assigned_levels = slice_jlpt_levels(stream, verbose=False, write_files=False, matches=matches)
+    levels = {}
+    for (level_number, level_entries) in sorted(assigned_levels.items(), key=lambda x: -x[0]):
+        for entry in level_entries:
+            levels.setdefault(int(entry['id']), level_number)
+    return levels, matches
+
+
+def compare_jmdict_versions(old_path, new_path, output_path='build/jmdict-diff.json'):
+    '''
+    Generates levels for two local JMDict files side by side, one process
+    each, and writes which IDs were added, removed or moved between levels
+    and which words now match a different entry.
+    '''
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        old_future = executor.submit(_version_levels, old_path)
+        new_future = executor.submit(_version_levels, new_path)
+        old_levels, old_matches = old_future.result()
+        new_levels, new_matches = new_future.result()
+
+    diff = {
+        'old': old_path,
+        'new': new_path,
+        'added': sorted([{'id': i, 'level': new_levels[i]} for i in new_levels.keys() - old_levels.keys()],
+                        key=lambda x: (-x['level'], x['id'])),
+        'removed': sorted([{'id': i, 'level': old_levels[i]} for i in old_levels.keys() - new_levels.keys()],
+                          key=lambda x: (-x['level'], x['id'])),
+        'moved': sorted([{'id': i, 'from': old_levels[i], 'to': new_levels[i]}
+                         for i in old_levels.keys() & new_levels.keys() if old_levels[i] != new_levels[i]],
+                        key=lambda x: (-x['from'], x['id'])),
+        'changed_matches': sorted([{'word': word, 'old': old_matches.get(word), 'new': new_matches.get(word)}
+                                   for word in old_matches.keys() | new_matches.keys()
+                                   if old_matches.get(word) != new_matches.get(word)],
+                                  key=lambda x: x['word']),
+    }
+    with open(output_path, 'w', encoding="utf-8") as f:
+        json.dump(diff, f, ensure_ascii=False, indent=1)
+    print(f"{len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['moved'])} moved, "
+          f"{len(diff['changed_matches'])} words changed match; written to {output_path}")
+    return diff
+
+
+def build_low_memory_index(all_jmes, sense_masks, word_frequencies, path='build/lowmem'):
+    '''
+    Writes the memory-mapped tables LowMemoryDictionary reads: JMDict
+    entries with their generated level, each surface word's candidate IDs
+    in match_word order, and frequency ranks. Rebuild them after
+    generation or --quotas rewrite the level files; until then
+    low_memory_index_is_current is false.
+    '''
+    if not os.path.exists(path):
+        os.makedirs(path)
+    levels = {}
+    for level_number in range(5, 0, -1):
+        if os.path.exists(f'build/jlpt-n{level_number}.txt'):
+            with open(f'build/jlpt-n{level_number}.txt', 'r', encoding="utf-8") as f:
+                for line in f:
+                    levels.setdefault(int(line), level_number)
+
+    jmes = {int(jme['id']): jme for jme in all_jmes}
+    answer_index.write_mapped_table(f'{path}/entries', (
+        (str(entry_id), json.dumps({'level': levels.get(entry_id), 'entry': jme}, ensure_ascii=False))
+        for (entry_id, jme) in jmes.items()
+    ))
+    answer_index.write_mapped_table(f'{path}/surface', (
+        (word, ','.join(str(entry_id) for entry_id in ids))
+        for (word, ids) in _build_candidate_index(all_jmes, sense_masks).items()
+    ))
+    answer_index.write_mapped_table(f'{path}/ranks', ((word, str(rank)) for (word, rank) in word_frequencies.items()))
+    # The baked-in levels also go stale when generation rewrites the level files.
+    answer_index.write_stamp(f'{path}.stamp', _generation_input_paths()
+                             + [f'build/jlpt-n{level}.txt' for level in range(1, 6)])
+
+
+def low_memory_index_is_current(path='build/lowmem'):
+    '''
+    Whether build_low_memory_index has written the tables at path and none
+    of their inputs, including the generated level files, changed since.
+    '''
+    return answer_index.stamp_is_current(f'{path}.stamp')
+
+
+class LowMemoryDictionary:
+    '''
+    Word lookup and batch classification over the tables written by
+    build_low_memory_index, for hosts that cannot hold JMDict in memory.
+
+    Nothing is loaded up front: every lookup binary searches memory-mapped
+    files. Private memory stays under LOW_MEMORY_CEILING_MB for single
+    lookups and streamed batches alike, as test_low_memory.py checks. On
+    top of that, RSS counts the table pages lookups have touched, at most
+    the size of build/lowmem; those pages are clean page cache shared
+    between worker processes, which the kernel can drop under pressure.
+    '''
+
+    def __init__(self, path='build/lowmem'):
+        self._entries = answer_index.MappedTable(f'{path}/entries')
+        self._surface = answer_index.MappedTable(f'{path}/surface')
+        self._ranks = answer_index.MappedTable(f'{path}/ranks')
+
+    def entry(self, entry_id):
+        '''
+        The JMDict entry and its generated level (or None) for an ID.
+        '''
+        value = self._entries.get(str(entry_id))
+        if value is None:
+            return None, None
+        value = json.loads(value)
+        return value['entry'], value['level']
+
+    def match_word(self, word):
+        '''
+        Same result as match_word(word, all_jmes), plus the entry's level.
+        '''
+        candidate_ids = self._surface.get(word)
+        if candidate_ids is None:
+            return None, None
+        return self.entry(candidate_ids.split(',')[0])
+
+    def rank(self, word):
+        rank = self._ranks.get(word)
+        return int(rank) if rank is not None else None
+
+    def classify_words(self, words):
+        '''
+        Yields (word, entry, level, rank) for each word, one at a time.
+        '''
+        for word in words:
+            entry, level = self.match_word(word)
+            yield word, entry, level, self.rank(word)
+
+    def close(self):
+        for table in [self._entries, self._surface, self._ranks]:
+            table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _coverage_weights(entries, occurrences):
+    '''
+    Tokens newly covered by each entry, in order.
+
+    An entry covers the tokens of all its surface forms; a form already
+    covered by an earlier entry is not counted again.
+    '''
+    covered_words = set()
+    weights = []
+    for entry in entries:
+        weight = 0
+        for item in entry['kanji'] + entry['kana']:
+            if item['text'] not in covered_words:
+                covered_words.add(item['text'])
+                weight += occurrences.get(item['text'], 0)
+        weights.append(weight)
+    return weights
+
+
+def _quota_coverage(cumulative_tokens, total_tokens, vocab_counts):
+    '''
+    Maps JLPT level to the cumulative fraction of corpus tokens covered by
+    that level and all easier ones, cutting the word sequence at the quotas.
+    '''
+    coverage = {}
+    cut = 0
+    for level_number in sorted(vocab_counts, reverse=True):
+        cut = min(cut + vocab_counts[level_number], len(cumulative_tokens))
+        coverage[level_number] = cumulative_tokens[cut - 1] / total_tokens if cut else 0.0
+    return coverage
+
+
+def corpus_coverage(assigned_levels, occurrences, total_tokens, what_if_counts=()):
+    '''
+    Computes what fraction of corpus tokens N5, N5+N4, and so on cover.
+    total_tokens is the size of the whole corpus, not just the listed words.
+
+    Returns the coverage of the generated levels, the cumulative coverage
+    curve over the generated word sequence (easiest level first) and the
+    coverage under each alternative quota setting in what_if_counts.
+
+    What-if quotas re-cut the generated sequence rather than re-matching,
+    so seeded JLPT list entries are not pinned to their level; for exact
+    what-ifs, slice a recorded candidate stream instead (see analyze_coverage).
+    '''
+    entries = []
+    level_sizes = {}
+    for (level_number, level_entries) in sorted(assigned_levels.items(), key=lambda x: -x[0]):
+        entries.extend(level_entries)
+        level_sizes[level_number] = len(level_entries)
+    cumulative_tokens = list(itertools.accumulate(_coverage_weights(entries, occurrences)))
+
+    curve = [tokens / total_tokens for tokens in cumulative_tokens]
+    coverage = _quota_coverage(cumulative_tokens, total_tokens, level_sizes)
+    what_ifs = [_quota_coverage(cumulative_tokens, total_tokens, counts) for counts in what_if_counts]
+    return coverage, curve, what_ifs
+
+
+def analyze_coverage(what_if_counts=(), frequency_path='japanese_wikipedia_word_freq.csv'):
+    stream = _load_current_candidate_stream()
+    if stream is not None:
+        entries = stream['entries']
+    else:
+        print('Loading JMDict...')
+        entries = _load_jmdict()
+
+    print('Reading generated JLPT levels...')
+    assigned_levels = _read_jlpt_levels(entries)
+
+    print('Getting Word Occurrences...')
+    occurrences, total_tokens = _get_wikipedia_word_occurrences(frequency_path)
+
+    if stream is not None:
+        coverage, curve, _ = corpus_coverage(assigned_levels, occurrences, total_tokens)
+        what_ifs = [
+            corpus_coverage(slice_jlpt_levels(stream, counts, verbose=False, write_files=False),
+                            occurrences, total_tokens)[0]
+            for counts in what_if_counts
+        ]
+    else:
+        coverage, curve, what_ifs = corpus_coverage(assigned_levels, occurrences, total_tokens, what_if_counts)
+    with open('build/coverage-curve.tsv', 'w', encoding="utf-8") as f:
+        for (words, fraction) in enumerate(curve, start=1):
+            f.write(f'{words}\t{fraction:.6f}\n')
+
+    print('Generated levels:')
+    for (level_number, fraction) in coverage.items():
+        print(f'    N{level_number}+: {100 * fraction:.2f}% of tokens')
+    for (counts, what_if) in zip(what_if_counts, what_ifs):
+        print(f"What if {', '.join(f'N{level}={count}' for (level, count) in counts.items())}:")
+        for (level_number, fraction) in what_if.items():
+            print(f'    N{level_number}+: {100 * fraction:.2f}% of tokens')
+
+
+def _export_records(stream):
+    '''
+    Yields one enriched record per generated word, easiest level first.
+    '''
+    entries = stream['entries']
+    exported_ids = set()
+    for level_number in range(5, 0, -1):
+        with open(f'build/jlpt-n{level_number}.txt', 'r', encoding="utf-8") as f:
+            for line in f:
+                entry_id = int(line)
+                # Seeded entries can also have been matched at an easier level.
+                if entry_id in exported_ids:
+                    continue
+                if entry_id not in entries:
+                    raise KeyError(f'{entry_id} in build/jlpt-n{level_number}.txt is missing from the candidate '
+                                   'stream; run classify.py to regenerate levels')
+                exported_ids.add(entry_id)
+                entry = entries[entry_id]
+                yield {
+                    'id': entry_id,
+                    'level': level_number,
+                    'kanji': entry['kanji'][0]['text'] if entry['kanji'] else None,
+                    'kana': entry['kana'][0]['text'] if entry['kana'] else None,
+                    'forms': [item['text'] for item in entry['kanji'] + entry['kana']],
+                    'glosses': entry['glosses'],
+                    'rank': _entry_frequency_rank(entry, stream['frequencies']),
+                }
+
+
+def _export_tsv(records, f):
+    f.write('id\tlevel\tkanji\tkana\tforms\tglosses\trank\n')
+    for record in records:
+        f.write('\t'.join([
+            str(record['id']),
+            f"N{record['level']}",
+            record['kanji'] or '',
+            record['kana'] or '',
+            '; '.join(record['forms']),
+            '; '.join(record['glosses']),
+            str(record['rank']) if record['rank'] is not None else '',
+        ]) + '\n')
+
+
+def _export_jsonl(records, f):
+    for record in records:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def _export_anki(records, f):
+    # Anki's plain text import reads these header lines as import options.
+    f.write('#separator:tab\n#html:true\n#columns:Front\tBack\tTags\n#tags column:3\n')
+    for record in records:
+        front = html.escape(record['kanji'] or record['kana'])
+        back = '<br>'.join(html.escape(field) for field in ([record['kana']] if record['kanji'] else []) + record['glosses'])
+        f.write(f"{front}\t{back.replace(chr(9), ' ')}\tJLPT::N{record['level']}\n")
+
+
+def _export_parquet(records, path, batch_size=1000):
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('level', pyarrow.int8()),
+        ('kanji', pyarrow.string()),
+        ('kana', pyarrow.string()),
+        ('forms', pyarrow.list_(pyarrow.string())),
+        ('glosses', pyarrow.list_(pyarrow.string())),
+        ('rank', pyarrow.int64()),
+    ])
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            writer.write_batch(pyarrow.RecordBatch.from_pylist(batch, schema=schema))
+
+
+def export_jlpt_levels(export_format, path):
+    '''
+    Streams the generated levels to path as TSV, JSONL, Parquet or an Anki
+    text import file, enriched from the recorded candidate stream so that
+    JMDict does not need to be loaded. Parquet output requires pyarrow.
+    '''
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}; expected one of {', '.join(EXPORT_FORMATS)}")
+    stream = _load_current_candidate_stream()
+    if stream is None:
+        raise FileNotFoundError('build/candidate-stream.json is missing or out of date; '
+                                'run classify.py to regenerate levels first')
+    records = _export_records(stream)
+    if export_format == 'parquet':
+        _export_parquet(records, path)
+        return
+    with open(path, 'w', encoding="utf-8") as f:
+        {'tsv': _export_tsv, 'jsonl': _export_jsonl, 'anki': _export_anki}[export_format](records, f)
 
 
 def plot_jlpt_list_densities(jlpt_levels, word_frequencies):
@@ -806,13 +1564,14 @@ def plot_jlpt_list_densities(jlpt_levels, word_frequencies):
     plot.show()
 
 
-def classify(search=None):
+def classify(search=None, vocab_counts=VOCAB_COUNTS):
     _make_build_dir()
 
     print('Loading JMDict...')
     jmdict = _load_jmdict()
     jmdict_common = _load_jmdict_common()
     all_jmes = list(jmdict_common.values()) + list(jmdict.values())
+    sense_masks = _build_sense_masks(all_jmes)
 
     print('Getting JLPT levels...')
     jlpt_lists = _get_jlpt_lists(jmdict)
@@ -820,10 +1579,17 @@ def classify(search=None):
     print('Getting Novel Word Frequencies...')
     novel_word_frequencies = _get_cb4960_word_frequencies()
     if search is None:
+        print('Recording candidate stream...')
+        stream = record_candidate_stream(all_jmes, jlpt_lists, novel_word_frequencies, sense_masks=sense_masks)
+        stream['fingerprint'] = _input_fingerprint()
+        save_candidate_stream(stream)
         print('Writing JLPT levels per Novel Word Frequencies...')
-        write_jlpt_levels(all_jmes, jlpt_lists, novel_word_frequencies)
+        assigned_levels = slice_jlpt_levels(stream, vocab_counts)
+        print('Writing kanji levels...')
+        write_kanji_levels(assigned_levels, novel_word_frequencies)
+        write_answer_index(stream, assigned_levels)
     else:
-        return match_word(search, all_jmes)
+        return match_word(search, all_jmes, sense_masks=sense_masks)
     if search is not None:
         return search_match
     #print('Plotting Novel JLPT histograms...')
@@ -846,13 +1612,64 @@ def classify(search=None):
     #plot_jlpt_list_densities(jlpt_lists, wikipedia_word_frequencies)
 
 
+def _exit_with_usage():
+    print(__doc__[__doc__.index('Usage:'):].rstrip(), file=sys.stderr)
+    sys.exit(2)
+
+
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
-        search = sys.argv[1]
-        match = classify(search=search)
-        if match is None:
+    command, arguments = (sys.argv[1], sys.argv[2:]) if len(sys.argv) >= 2 else (None, [])
+    if command is None:
+        classify()
+    elif command == '--coverage':
+        # Optional what-if quotas, e.g. 800,1500,3750,6000,10000 for N5 through N1.
+        what_if_counts = [_parse_vocab_counts(arg) for arg in arguments]
+        if None in what_if_counts:
+            _exit_with_usage()
+        analyze_coverage(what_if_counts)
+    elif command == '--compare':
+        # Local jmdict-simplified JSON files for the old and new version, and an optional output path.
+        if len(arguments) not in (2, 3):
+            _exit_with_usage()
+        compare_jmdict_versions(*arguments)
+    elif command == '--build-low-memory':
+        if arguments:
+            _exit_with_usage()
+        _make_build_dir()
+        jmdict = _load_jmdict()
+        all_jmes = list(_load_jmdict_common().values()) + list(jmdict.values())
+        build_low_memory_index(all_jmes, _build_sense_masks(all_jmes), _get_cb4960_word_frequencies())
+    elif command == '--low-memory':
+        # Words to look up, or - to classify words read from stdin one per line.
+        if not arguments:
+            _exit_with_usage()
+        if not low_memory_index_is_current():
+            sys.exit('build/lowmem is missing or out of date; run classify.py --build-low-memory first')
+        words = (line.strip() for line in sys.stdin) if arguments == ['-'] else arguments
+        with LowMemoryDictionary() as dictionary:
+            for (word, entry, level, rank) in dictionary.classify_words(words):
+                if entry is None:
+                    print(f"{word} No match")
+                else:
+                    print(f"{word} {entry['id']} {f'N{level}' if level else '-'} {_qualified_gloss(entry)}")
+    elif command == '--export':
+        if len(arguments) != 2 or arguments[0] not in EXPORT_FORMATS:
+            _exit_with_usage()
+        export_jlpt_levels(*arguments)
+    elif command == '--quotas':
+        # Quotas for N5 through N1, e.g. 800,1500,3750,6000,10000.
+        vocab_counts = _parse_vocab_counts(arguments[0]) if len(arguments) == 1 else None
+        if vocab_counts is None:
+            _exit_with_usage()
+        if reslice_jlpt_levels(vocab_counts) is None:
+            print('Candidate stream is missing or out of date; re-matching...')
+            classify(vocab_counts=vocab_counts)
+    elif command.startswith('-') or arguments:
+        _exit_with_usage()
+    else:
+        # lookup.py answers the same way without importing this module.
+        answer = lookup_word(command)
+        if answer is None:
             print("No match")
         else:
-            print(f"{match['id']} {match['sense'][0]['gloss'][0]['text']}")
-    else:
-        classify()
+            print(f"{answer[0]} {answer[1]}")
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Fast word lookup. Answers from the index written by classify.py when it is
+current, and only imports classify.py to look the word up otherwise.
+
+Usage: lookup.py WORD
+'''
+import sys
+
+import answer_index
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__[__doc__.index('Usage:'):].rstrip(), file=sys.stderr)
+        sys.exit(2)
+    answer = answer_index.lookup_answer(sys.argv[1])
+    if answer is None:
+        import classify
+        answer = classify.lookup_word(sys.argv[1])
+    if answer is None:
+        print("No match")
+    else:
+        print(f"{answer[0]} {answer[-1]}")
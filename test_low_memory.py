@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+'''
+Peak memory of the low-memory lookup mode, measured in a subprocess on a
+synthetic dictionary and checked against classify.LOW_MEMORY_CEILING_MB.
+'''
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import classify
+
+CLASSIFY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classify.py')
+ENTRY_COUNT = 20000
+BATCH_SIZE = 100000
+KANJI = '日本人大小山川田中上下学生先年月火水木金土何時間食飲見行来出入口目耳手足'
+KANA = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわん'
+
+# Runs classify.py as __main__, then reports its own memory high-water marks.
+RUNNER = '''
+import os, runpy, sys
+script = sys.argv[1]
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(script))
+try:
+    runpy.run_path(script, run_name='__main__')
+finally:
+    with open('/proc/self/status') as f:
+        sys.stderr.write(f.read())
+'''
+
+pytestmark = pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason='needs /proc/self/status')
+
+
+def _synthetic_jmes(rng):
+    jmes = []
+    for i in range(ENTRY_COUNT):
+        kanji = [{'text': ''.join(rng.choice(KANJI) for _ in range(rng.randint(1, 3))), 'common': rng.random() < .3, 'tags': []}
+                 for _ in range(rng.choice([0, 1, 1, 2]))]
+        kana = [{'text': ''.join(rng.choice(KANA) for _ in range(rng.randint(1, 4))), 'common': rng.random() < .3, 'tags': []}
+                for _ in range(rng.randint(1, 2))]
+        sense = [{'partOfSpeech': [rng.choice(['n', 'v5r', 'adj-i', 'arch'])], 'field': [], 'misc': [], 'related': [],
+                  'gloss': [{'text': f'meaning {i} {j}'}]}
+                 for j in range(rng.randint(1, 3))]
+        jmes.append({'id': str(1000000 + i), 'kanji': kanji, 'kana': kana, 'sense': sense})
+    return jmes
+
+
+@pytest.fixture(scope='module')
+def lowmem_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('lowmem')
+    rng = random.Random(0)
+    jmes = _synthetic_jmes(rng)
+    words = list({item['text'] for jme in jmes for item in jme['kanji'] + jme['kana']})
+    rng.shuffle(words)
+    # The tables' stamp names its inputs relative to the directory they are used from.
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        classify.build_low_memory_index(jmes, classify._build_sense_masks(jmes),
+                                        {word: rank for (rank, word) in enumerate(words)})
+    finally:
+        os.chdir(cwd)
+    with open(directory / 'batch.txt', 'w', encoding="utf-8") as f:
+        f.write('\n'.join(rng.choice(words) for _ in range(BATCH_SIZE)))
+    return directory
+
+
+def _measure(directory, args, stdin=None):
+    '''
+    Runs classify.py with args in directory and returns (VmHWM, RssAnon) in MB.
+    '''
+    result = subprocess.run([sys.executable, '-c', RUNNER, CLASSIFY_PATH] + args, cwd=directory,
+                            stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            encoding="utf-8", check=True)
+    status = dict(line.split(':', 1) for line in result.stderr.splitlines() if ':' in line)
+    peak_mb, anon_mb = (int(status[key].split()[0]) / 1024 for key in ['VmHWM', 'RssAnon'])
+    print(f"{' '.join(args)}: peak RSS {peak_mb:.1f}MB, private {anon_mb:.1f}MB")
+    return peak_mb, anon_mb
+
+
+def _tables_mb(directory):
+    tables = directory / 'build' / 'lowmem'
+    return sum(os.path.getsize(tables / name) for name in os.listdir(tables)) / 1024 / 1024
+
+
+def test_single_word_lookup_stays_under_ceiling(lowmem_dir):
+    peak_mb, anon_mb = _measure(lowmem_dir, ['--low-memory', KANA[0]])
+    assert anon_mb <= classify.LOW_MEMORY_CEILING_MB
+    # Touched table pages are file-backed and can add at most the tables' size.
+    assert peak_mb <= classify.LOW_MEMORY_CEILING_MB + _tables_mb(lowmem_dir)
+
+
+def test_batch_classification_stays_under_ceiling(lowmem_dir):
+    with open(lowmem_dir / 'batch.txt', encoding="utf-8") as batch:
+        peak_mb, anon_mb = _measure(lowmem_dir, ['--low-memory', '-'], stdin=batch)
+    assert anon_mb <= classify.LOW_MEMORY_CEILING_MB
+    assert peak_mb <= classify.LOW_MEMORY_CEILING_MB + _tables_mb(lowmem_dir)
+
+
+def test_stale_tables_are_refused(lowmem_dir):
+    level_path = lowmem_dir / 'build' / 'jlpt-n5.txt'
+    level_path.write_text('1000000\n')
+    try:
+        result = subprocess.run([sys.executable, CLASSIFY_PATH, '--low-memory', KANA[0]], cwd=lowmem_dir,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
+    finally:
+        level_path.unlink()
+    assert result.returncode != 0
+    assert '--build-low-memory' in result.stderr
+    assert not result.stdout
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+'''
+Cold-start guards for lookup.py: import time of the fast-path module and
+wall time of an answer-index hit, relative to a bare interpreter.
+'''
+import os
+import subprocess
+import sys
+import time
+
+import answer_index
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LOOKUP_PATH = os.path.join(ROOT, 'lookup.py')
+# How many milliseconds an answer-index hit may take on top of `python -c
+# pass`, and in total. The total depends on the host, so it is only enforced
+# when JLPT_STRICT_STARTUP is set, e.g. on the machine the budget was set for.
+STARTUP_BUDGET_MS = 30
+COLD_START_BUDGET_MS = 50
+# Milliseconds `import answer_index` may take, including its dependencies.
+IMPORT_BUDGET_MS = 10
+# Modules the fast path must not pull in.
+HEAVY_MODULES = {'classify', 'json', 'hashlib', 'requests', 'zipfile', 'concurrent', 'matplotlib'}
+RUNS = 7
+
+
+def _best_wall_ms(args, cwd):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=cwd, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def test_answer_index_hit_is_within_startup_budget(tmp_path):
+    (tmp_path / 'build').mkdir()
+    (tmp_path / 'input.csv').write_text('1000320\n')
+    answer_index.write_answer_index(
+        [(f'word{i}', 1000000 + i, i % 5 + 1, f'meaning {i}') for i in range(10000)],
+        [str(tmp_path / 'input.csv')], path=str(tmp_path / 'build' / 'answers'))
+
+    output = subprocess.run([sys.executable, LOOKUP_PATH, 'word42'], cwd=tmp_path,
+                            stdout=subprocess.PIPE, encoding="utf-8", check=True).stdout
+    assert output == '1000042 meaning 42\n'
+
+    bare_ms = _best_wall_ms(['-c', 'pass'], tmp_path)
+    lookup_ms = _best_wall_ms([LOOKUP_PATH, 'word42'], tmp_path)
+    print(f'bare interpreter {bare_ms:.1f}ms, lookup.py {lookup_ms:.1f}ms')
+    assert lookup_ms - bare_ms <= STARTUP_BUDGET_MS
+    if os.environ.get('JLPT_STRICT_STARTUP'):
+        assert lookup_ms <= COLD_START_BUDGET_MS
+
+
+def test_fast_path_imports_are_light():
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import answer_index'], cwd=ROOT,
+                            stderr=subprocess.PIPE, encoding="utf-8", check=True)
+    cumulative_us = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        self_us, total_us, name = line.split(':', 1)[1].split('|')
+        if total_us.strip().isdigit():
+            cumulative_us[name.strip()] = int(total_us)
+    assert not HEAVY_MODULES.intersection(name.split('.')[0] for name in cumulative_us)
+    assert cumulative_us['answer_index'] / 1000 <= IMPORT_BUDGET_MS